@@ -2,9 +2,11 @@ import configparser
 import logging
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from itertools import chain
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List
 
 import openstack.connection as openstack_connection
 import typer
@@ -19,6 +21,12 @@ NODE_NAME_ENV_VAR = "NODENAME"
 
 PORT_DOWN_STATUS = "DOWN"
 
+# only request the port attributes actually used, to keep responses small
+PORT_FIELDS = ['id', 'name', 'status', 'device_id', 'mac_address', 'fixed_ips']
+CLEANUP_PORT_FIELDS = ['id', 'name', 'status', 'device_id']
+
+MAX_WORKERS = 8
+
 LOG_FORMAT = "%(asctime)s.%(msecs)-3d %(levelname)-8s [%(filename)s:%(lineno)-3d] %(message)s"
 LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
@@ -103,31 +111,86 @@ def _reconciliation_interval_option() -> typer.Option:
 
 
 def _cleanup_ports(os_conn: openstack_connection.Connection, port_tags: List[str], logger: logging.Logger):
-    os_all_ports = os_conn.list_ports(filters={'tags': port_tags})
-    for os_port in os_all_ports:
-        if os_port.status == PORT_DOWN_STATUS and not os_port.device_id:
-            logger.info(
-                f"Delete unused port {os_port.name} ({os_port.id}, {os_port.status}, {os_port.device_id or 'None'})."
-            )
-            try:
-                os_conn.delete_port(os_port.id)
-            except OpenStackCloudException as e:
-                logger.warn(f"Error while deleting unused port {os_port.name}: {e}")
+    def _delete_port(os_port: Any):
+        logger.info(
+            "Delete unused port %s (%s, %s, %s).", os_port.name, os_port.id, os_port.status, os_port.device_id or 'None'
+        )
+        try:
+            os_conn.delete_port(os_port.id)
+        except OpenStackCloudException as e:
+            logger.warning("Error while deleting unused port %s: %s", os_port.name, e)
+
+    os_down_ports = os_conn.list_ports(
+        filters={'tags': port_tags, 'status': PORT_DOWN_STATUS, 'fields': CLEANUP_PORT_FIELDS}
+    )
+    os_unused_ports = [os_port for os_port in os_down_ports if not os_port.device_id]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(_delete_port, os_unused_ports))
 
 
 def _wait_for_port(
-    os_conn: openstack_connection.Connection, os_port_name: str, max_retries: int = 10, sleepy_time: int = 5
-):
+    os_conn: openstack_connection.Connection,
+    os_port_name: str,
+    max_total_wait: float = 60,
+    initial_delay: float = 1,
+    max_delay: float = 30,
+) -> Any:
     # Note(sprietl): quick and dirty implementation, no error handling atm
-    current_try = 0
+    delay = initial_delay
+    deadline = time.monotonic() + max_total_wait
     while True:
         os_port = os_conn.get_port(os_port_name)
         if os_port.status != PORT_DOWN_STATUS:
             break
-        current_try += 1
-        if current_try > max_retries:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
             break
-        time.sleep(sleepy_time)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+    return os_port
+
+
+def _wait_for_next_reconciliation(
+    next_reconciliation: float, reconciliation_interval: int, logger: logging.Logger
+) -> float:
+    # sleep only the rest of the interval, so the time spent reconciling does not add up
+    next_reconciliation += reconciliation_interval
+    sleep_time = next_reconciliation - time.monotonic()
+    if sleep_time > 0:
+        logger.debug("Wait for %.2fs until reconciliation.", sleep_time)
+        time.sleep(sleep_time)
+    else:
+        if reconciliation_interval:
+            logger.warning("Reconciliation overran interval by %.2fs.", -sleep_time)
+        next_reconciliation = time.monotonic()
+
+    return next_reconciliation
+
+
+def _ensure_port(
+    os_conn: openstack_connection.Connection,
+    os_server: Any,
+    os_subnet: Any,
+    os_managed_ports: Dict[str, Any],
+    port_name_prefix: str,
+    logger: logging.Logger,
+) -> Any:
+    logger.info("Will add port with subnet '%s' to server '%s'.", os_subnet.name, os_server.name)
+
+    # TODO(sprietl): Make name of port and finding more general, to reuse previously created ones
+    os_port_name = f"{port_name_prefix}-{os_server.name}-{os_subnet.name}"
+    os_port = os_managed_ports.get(os_port_name)
+    if not os_port:
+        logger.info("Will create a new port because '%s' does not exist.", os_port_name)
+        os_port = os_conn.create_port(
+            name=os_port_name,
+            network_id=os_subnet.network_id,
+            # Note(sprietl): For now we only create ports with one IP
+            fixed_ips=[{'subnet_id': os_subnet.id}],
+        )
+
+    return os_port
 
 
 @app.command()
@@ -163,13 +226,19 @@ def main(
     do_cleanup = False
     if cleanup_node_pattern:
         do_cleanup = re.match(cleanup_node_pattern, node_name) != None
-    logger.info(f"Will clean up unused ports: {do_cleanup}")
+    logger.info("Will clean up unused ports: %s", do_cleanup)
 
     # setup OS connection
     cloud_config_parser = configparser.ConfigParser()
     cloud_config_parser.read(cloud_config)
 
-    os_options = {k: v.strip('"') for k, v in cloud_config_parser['global'].items() if v.strip('"')}
+    os_options = {}
+    for k, v in cloud_config_parser['global'].items():
+        # values may or may not be quoted in the cloud config
+        if '"' in v:
+            v = v.strip('"')
+        if v:
+            os_options[k] = v
     if "application-credential-id" in os_options:
         os_options['auth-type'] = "v3applicationcredential"
 
@@ -179,16 +248,30 @@ def main(
     os_server = os_conn.get_server(node_name)
 
     if not os_server:
-        logger.critical(f"Unable to find server '{node_name}'.")
+        logger.critical("Unable to find server '%s'.", node_name)
         raise typer.Exit(1)
 
     # get subnets
+    # fetch all subnets at once and resolve names/ids locally instead of one request per subnet
+    os_all_subnets = os_conn.list_subnets()
+    os_subnets_by_id = {os_subnet.id: os_subnet for os_subnet in os_all_subnets}
+    os_subnets_by_name = {}
+    for os_subnet in os_all_subnets:
+        os_subnets_by_name.setdefault(os_subnet.name, []).append(os_subnet)
+
     os_expected_subnets = {}
     for subnet in subnets:
-        os_subnet = os_conn.get_subnet(subnet)
+        os_subnet = os_subnets_by_id.get(subnet)
+        if not os_subnet:
+            os_named_subnets = os_subnets_by_name.get(subnet, [])
+            if len(os_named_subnets) > 1:
+                logger.critical("Found multiple subnets named '%s', please use its id instead.", subnet)
+                raise typer.Exit(1)
+            os_subnet = os_named_subnets[0] if os_named_subnets else None
 
         if not os_subnet:
-            logger.critical(f"Unable to find subnet '{subnet}'.")
+            logger.critical("Unable to find subnet '%s'.", subnet)
+            raise typer.Exit(1)
 
         os_expected_subnets[os_subnet.id] = os_subnet
 
@@ -196,86 +279,95 @@ def main(
     networking_config_handler_kwargs = {}
     if apply_cmd:
         apply_cmd = apply_cmd.split()
-        logger.debug(f"Set apply cmd to: {apply_cmd}")
+        logger.debug("Set apply cmd to: %s", apply_cmd)
         networking_config_handler_kwargs['apply_cmd'] = apply_cmd
 
     networking_config_handler = get_networking_config_handler(
-        networking_config_type, **networking_config_handler_kwargs
+        networking_config_type, networking_config_templates, **networking_config_handler_kwargs
     )
 
     # main loop
+    os_expected_subnet_ids = frozenset(os_expected_subnets)
+    next_reconciliation = time.monotonic()
     while True:
         # cleanup unused ports
         if do_cleanup:
             _cleanup_ports(os_conn, port_tags, logger)
 
         # get actual subnet ids from the ports attached to the server
-        os_actual_ports = os_conn.list_ports(filters={'device_id': os_server.id})
-        os_actual_subnet_ids = []
-        for os_port in os_actual_ports:
-            for fixed_ip in os_port.fixed_ips:
-                os_actual_subnet_ids.append(fixed_ip['subnet_id'])
+        os_actual_ports = os_conn.list_ports(filters={'device_id': os_server.id, 'fields': PORT_FIELDS})
+        os_actual_subnet_ids = {
+            fixed_ip['subnet_id'] for fixed_ip in chain.from_iterable(os_port.fixed_ips for os_port in os_actual_ports)
+        }
 
         # find out what subnets are missing on the server
-        os_expected_subnet_ids = set(os_expected_subnets.keys())
-
         # on "boot" we declare all are missing
         if networking_config_handler.should_apply:
             os_missing_subnet_ids = os_expected_subnet_ids
         else:
-            os_missing_subnet_ids = os_expected_subnet_ids - set(os_actual_subnet_ids)
+            os_missing_subnet_ids = os_expected_subnet_ids - os_actual_subnet_ids
 
         logger.debug(
-            msg=(
-                "Result of missing subnets calculation:\n"
-                f"  actual:   {os_actual_subnet_ids}\n"
-                f"  expected: {os_expected_subnet_ids}\n"
-                f"  missing:  {os_missing_subnet_ids}"
-            )
+            "Result of missing subnets calculation:\n  actual:   %s\n  expected: %s\n  missing:  %s",
+            os_actual_subnet_ids,
+            os_expected_subnet_ids,
+            os_missing_subnet_ids,
         )
 
         # for every missing subnet, create a new port and add it to the server, or add an existing one
-        for os_missing_subnet_id in os_missing_subnet_ids:
-            os_missing_subnet = os_expected_subnets[os_missing_subnet_id]
-            logger.info(f"Will add port with subnet '{os_missing_subnet.name}' to server '{os_server.name}'.")
-
-            # TODO(sprietl): Make name of port and finding more general, to reuse previously created ones
-            os_port_name = f"{port_name_prefix}-{os_server.name}-{os_missing_subnet.name}"
-            os_port = os_conn.get_port(os_port_name)
-            if not os_port:
-                logger.info(f"Will create a new port because '{os_port_name}' does not exist.")
-                os_port = os_conn.create_port(
-                    name=os_port_name,
-                    network_id=os_missing_subnet.network_id,
-                    # Note(sprietl): For now we only create ports with one IP
-                    fixed_ips=[{'subnet_id': os_missing_subnet_id}],
+        # ports are looked up/created concurrently, but attached one at a time
+        os_missing_subnets = [
+            os_expected_subnets[os_missing_subnet_id] for os_missing_subnet_id in sorted(os_missing_subnet_ids)
+        ]
+        if os_missing_subnets:
+            # look up all wanted ports at once, neutron accepts a list of names
+            os_managed_port_names = [
+                f"{port_name_prefix}-{os_server.name}-{os_missing_subnet.name}"
+                for os_missing_subnet in os_missing_subnets
+            ]
+            os_managed_ports = {
+                os_port.name: os_port
+                for os_port in os_conn.list_ports(filters={'name': os_managed_port_names, 'fields': PORT_FIELDS})
+            }
+
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                os_missing_ports = list(
+                    executor.map(
+                        lambda os_missing_subnet: _ensure_port(
+                            os_conn, os_server, os_missing_subnet, os_managed_ports, port_name_prefix, logger
+                        ),
+                        os_missing_subnets,
+                    )
                 )
 
-            # tag ports
-            if port_tags:
-                os_conn.network.set_tags(os_port, port_tags)
-
-            if not os_port.device_id:
-                os_conn.compute.create_server_interface(os_server.id, port_id=os_port.id)
-
-            # wait for port become active
-            if wait_for_port:
-                logger.debug(f"Waiting for port {os_port_name}")
-                _wait_for_port(os_conn, os_port_name)
-
-            # create networking config for the port
-            networking_config_handler.create(
-                os_port=os_port,
-                os_subnet=os_missing_subnet,
-                config_destination=networking_config_destination,
-                config_templates=networking_config_templates,
-            )
+                # nova rejects attaching an interface while another attach to the server is in progress
+                for os_port in os_missing_ports:
+                    if not os_port.device_id:
+                        os_conn.compute.create_server_interface(os_server.id, port_id=os_port.id)
+
+                # tag ports after attaching them, so the cleanup of other nodes does not pick them up
+                if port_tags:
+                    list(executor.map(lambda os_port: os_conn.network.set_tags(os_port, port_tags), os_missing_ports))
+
+                # wait for ports become active
+                if wait_for_port:
+                    logger.debug("Waiting for ports %s", [os_port.name for os_port in os_missing_ports])
+                    os_missing_ports = list(
+                        executor.map(lambda os_port: _wait_for_port(os_conn, os_port.name), os_missing_ports)
+                    )
+
+            # create networking config for the ports
+            for os_missing_subnet, os_port in zip(os_missing_subnets, os_missing_ports):
+                networking_config_handler.create(
+                    os_port=os_port,
+                    os_subnet=os_missing_subnet,
+                    config_destination=networking_config_destination,
+                )
 
         # apply networking config if necessary
         networking_config_handler.apply()
 
-        logger.debug(f"Wait for {reconciliation_interval}s until reconciliation.")
-        time.sleep(reconciliation_interval)
+        next_reconciliation = _wait_for_next_reconciliation(next_reconciliation, reconciliation_interval, logger)
 
 
 if __name__ == "__main__":
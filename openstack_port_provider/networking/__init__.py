@@ -1,4 +1,5 @@
 from enum import Enum
+from pathlib import Path
 
 from .base import BaseNetworkingConfigHandler
 from .netplan import NetplanNetworkingConfigHandler
@@ -8,10 +9,12 @@ class NetworkingConfigType(str, Enum):
     netplan = "netplan"
 
 
-def get_networking_config_handler(config_type: NetworkingConfigType, **kwargs) -> BaseNetworkingConfigHandler:
+def get_networking_config_handler(
+    config_type: NetworkingConfigType, config_templates: Path, **kwargs
+) -> BaseNetworkingConfigHandler:
     if config_type == NetworkingConfigType.netplan:
         if "apply_cmd" in kwargs:
-            return NetplanNetworkingConfigHandler(apply_cmd=kwargs['apply_cmd'])
-        return NetplanNetworkingConfigHandler()
+            return NetplanNetworkingConfigHandler(config_templates, apply_cmd=kwargs['apply_cmd'])
+        return NetplanNetworkingConfigHandler(config_templates)
 
     raise ValueError(f"No networking config handler for '{config_type.value}' found.")
@@ -1,11 +1,12 @@
 from abc import ABCMeta, abstractmethod
 from pathlib import Path
-from typing import Any
+from typing import Any, Set
 
 
 class BaseNetworkingConfigHandler(metaclass=ABCMeta):
     def __init__(self, should_apply: bool = True) -> None:
         self.should_apply = should_apply
+        self._dirty_configs: Set[Path] = set()
 
     @abstractmethod
     def create(
@@ -13,7 +14,6 @@ class BaseNetworkingConfigHandler(metaclass=ABCMeta):
         os_port: Any,
         os_subnet: Any,
         config_destination: Path,
-        config_templates: Path,
     ) -> None:
         raise NotImplementedError
 
@@ -23,7 +23,7 @@ class BaseNetworkingConfigHandler(metaclass=ABCMeta):
 
     @property
     def should_apply(self) -> bool:
-        return self._should_apply
+        return self._should_apply or bool(self._dirty_configs)
 
     @should_apply.setter
     def should_apply(self, value: bool):
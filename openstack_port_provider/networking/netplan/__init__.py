@@ -1,52 +1,112 @@
+import copy
 import logging
 import subprocess
 from pathlib import Path
-from typing import Any, List
+from typing import Any, Dict, List, Optional
 
 import psutil
 import yaml
 
 from ..base import BaseNetworkingConfigHandler
 
+try:
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
 NAME_PREFIX = "opp"
+CONFIG_NAME_PREFIX = f"51-{NAME_PREFIX}-ens"
 INTERFACE_NUMBER_OFFSET = 4
 
 
+def _get_config_macaddress(networking_config: Any) -> Optional[str]:
+    networking_if_configs = ((networking_config or {}).get('network') or {}).get('ethernets') or {}
+    for networking_if_config in networking_if_configs.values():
+        macaddress = ((networking_if_config or {}).get('match') or {}).get('macaddress')
+        if macaddress is not None:
+            return str(macaddress).lower()
+    return None
+
+
 class NetplanNetworkingConfigHandler(BaseNetworkingConfigHandler):
-    def __init__(self, apply_cmd: List[str] = ['netplan', 'apply']) -> None:
+    def __init__(self, config_templates: Path, apply_cmd: List[str] = ['netplan', 'apply']) -> None:
         super().__init__()
         self.logger = logging.getLogger(__name__)
         self.apply_cmd = apply_cmd
+        self._config_templates = self._load_config_templates(config_templates)
+        self._net_if_stats_cache = None
+        self._config_macaddresses_cache = None
+
+    def _load_config_templates(self, config_templates: Path) -> Dict[str, Any]:
+        config_templates_by_subnet_name = {}
+        for config_template_path in config_templates.glob("*.yaml"):
+            with open(config_template_path, "r") as f:
+                config_templates_by_subnet_name[config_template_path.stem] = yaml.load(f, Loader=SafeLoader)
+        return config_templates_by_subnet_name
+
+    def _net_if_stats(self) -> Dict[str, Any]:
+        # cache interfaces for one reconciliation pass, they are reset in apply()
+        if self._net_if_stats_cache is None:
+            self._net_if_stats_cache = psutil.net_if_stats()
+        return self._net_if_stats_cache
+
+    def _config_macaddresses(self, config_destination: Path) -> Dict[int, Optional[str]]:
+        # cache the interface numbers and mac addresses of existing configs for one reconciliation pass
+        if self._config_macaddresses_cache is None:
+            self._config_macaddresses_cache = {}
+            for config_path in config_destination.glob(f"{CONFIG_NAME_PREFIX}*.yaml"):
+                if_number = config_path.stem.removeprefix(CONFIG_NAME_PREFIX)
+                if not if_number.isdigit():
+                    continue
+                with open(config_path, "r") as f:
+                    networking_config = yaml.load(f, Loader=SafeLoader)
+                self._config_macaddresses_cache[int(if_number)] = _get_config_macaddress(networking_config)
+        return self._config_macaddresses_cache
+
+    def _get_if_number(self, os_port: Any, config_destination: Path, net_if_stats: Dict[str, Any]) -> int:
+        config_macaddresses = self._config_macaddresses(config_destination)
+        macaddress = str(os_port['mac_address']).lower()
+
+        # reuse the number of an existing config for the port
+        for if_number in sorted(config_macaddresses):
+            if config_macaddresses[if_number] == macaddress:
+                return if_number
+
+        # otherwise take the lowest number neither used by a config nor an existing interface
+        if_number = INTERFACE_NUMBER_OFFSET
+        while if_number in config_macaddresses or f"ens{if_number}" in net_if_stats:
+            if_number += 1
+
+        # reserve the number for the rest of the pass
+        config_macaddresses[if_number] = macaddress
+        return if_number
 
     def create(
         self,
         os_port: Any,
         os_subnet: Any,
         config_destination: Path,
-        config_templates: Path,
     ) -> None:
-        # Note(sprietl):
-        #   This is a naive approach on how to number the interfaces.
-        #   But for complexity reasons we leave it for now like this.
-        # TODO(sprietl):
-        #   This is a bug, when adding multiple interfaces name stays the same.
-        #   Move to loop, and make sure if is unique.
-        if_number = INTERFACE_NUMBER_OFFSET
+        net_if_stats = self._net_if_stats()
+
+        # interface numbers are derived from the configs on disk, so they stay stable across restarts
+        # configs of removed ports are not cleaned up and keep their number reserved
+        if_number = self._get_if_number(os_port, config_destination, net_if_stats)
         networking_if_name = f"ens{if_number}"
 
-        net_if_stats = psutil.net_if_stats()
         # TODO(sprietl):
         #   * Test if if is up as well (net_if_stats[networking_if_name].isup)?
         #   * Make configurable if this should lead to abort, or error, for now just ignore and warn.
         if networking_if_name in net_if_stats:
             self.logger.warning(
-                f"Interface with name {networking_if_name} already exists, not creating/applying network config."
+                "Interface with name %s already exists, not creating/applying network config.", networking_if_name
             )
             self.should_apply = False
             return
 
         if len(os_port.fixed_ips) > 1:
-            self.logger.warning(f"Port '{os_port.name}' has more than one IP address ({os_port.fixed_ips}).")
+            self.logger.warning("Port '%s' has more than one IP address (%s).", os_port.name, os_port.fixed_ips)
 
         # Note(sprietl): For now we only get the first fixed IP
         os_port_fixed_ip = os_port.fixed_ips[0]
@@ -55,14 +115,14 @@ class NetplanNetworkingConfigHandler(BaseNetworkingConfigHandler):
         if os_port_subnet_id != os_subnet.id:
             raise ValueError(f"Provided port '{os_port.name}' is not in provided subnet '{os_subnet.name}'")
 
-        config_base_name = f"51-{NAME_PREFIX}-{networking_if_name}.yaml"
+        config_base_name = f"{CONFIG_NAME_PREFIX}{if_number}.yaml"
         config_path = config_destination / config_base_name
 
-        config_template_base_name = f"{os_subnet.name}.yaml"
-        config_templates_path = config_templates / config_template_base_name
+        if os_subnet.name not in self._config_templates:
+            raise ValueError(f"No networking config template found for subnet '{os_subnet.name}'")
 
-        with open(config_templates_path, "r") as f:
-            networking_config = yaml.safe_load(f)
+        # templates are loaded once, copy them because the config gets modified below
+        networking_config = copy.deepcopy(self._config_templates[os_subnet.name])
 
         networking_if_address = f"{os_port_fixed_ip['ip_address']}/{os_subnet.cidr.split('/')[-1]}"
 
@@ -72,33 +132,48 @@ class NetplanNetworkingConfigHandler(BaseNetworkingConfigHandler):
         networking_if_config['set-name'] = networking_if_name
         networking_config['network']['ethernets'][networking_if_name] = networking_if_config
 
-        with open(config_path, "w") as f:
-            networking_config_yaml = yaml.safe_dump(networking_config)
-            self.logger.debug(networking_config_yaml)
-            f.write(networking_config_yaml)
+        networking_config_yaml = yaml.dump(networking_config, Dumper=SafeDumper, default_flow_style=False)
+        self.logger.debug(networking_config_yaml)
+
+        try:
+            existing_networking_config_yaml = config_path.read_text()
+        except FileNotFoundError:
+            existing_networking_config_yaml = None
 
-        self.should_apply = True
+        if existing_networking_config_yaml == networking_config_yaml:
+            self.logger.debug("Networking config '%s' is unchanged.", config_path)
+        else:
+            with open(config_path, "w") as f:
+                f.write(networking_config_yaml)
 
-    def _format_output(self, output: bytes, indent: int = 4) -> str:
-        lines = output.decode().strip("\n").splitlines()
+        # the interface does not exist yet, so even an unchanged config is not in effect and has to be applied
+        self._dirty_configs.add(config_path)
 
-        formatted_output = ""
-        for line in lines:
-            formatted_output += f"{' ' * indent}{line}\n"
+    def _format_output(self, output: str, indent: int = 4) -> str:
+        lines = output.strip("\n").splitlines()
+        prefix = " " * indent
 
-        return formatted_output
+        return "".join(f"{prefix}{line}\n" for line in lines)
 
     def apply(self) -> None:
+        # apply() ends a reconciliation pass, so always refresh the interfaces and configs for the next one
+        self._net_if_stats_cache = None
+        self._config_macaddresses_cache = None
+
         if not self.should_apply:
             self.logger.debug("Nothing to apply.")
             return
 
         self.logger.info("Apply networking config.")
         try:
-            netplan_output = self._format_output(subprocess.check_output(self.apply_cmd, stderr=subprocess.STDOUT))
-            self.logger.debug(f"Netplan output:\n{netplan_output}")
+            result = subprocess.run(
+                self.apply_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, check=True
+            )
+            netplan_output = self._format_output(result.stdout)
+            self.logger.debug("Netplan output:\n%s", netplan_output)
             self.should_apply = False
+            self._dirty_configs.clear()
         except subprocess.CalledProcessError as e:
-            netplan_output = self._format_output(e.output)
-            self.logger.error(f"Unable to apply networking config: {e}\n  Netplan output:\n{netplan_output}")
+            netplan_output = self._format_output(e.stdout)
+            self.logger.error("Unable to apply networking config: %s\n  Netplan output:\n%s", e, netplan_output)
             raise e
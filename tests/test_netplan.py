@@ -0,0 +1,122 @@
+from types import SimpleNamespace
+
+import psutil
+import pytest
+import yaml
+
+from openstack_port_provider.networking.netplan import NetplanNetworkingConfigHandler
+
+CONFIG_TEMPLATE = """\
+network:
+  version: 2
+  ethernets:
+    ensX:
+      match: {}
+"""
+
+SUBNET = SimpleNamespace(id="subnet-id", name="subnet", cidr="10.0.0.0/24")
+
+
+class FakePort(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+
+def _port(port_id, mac_address, ip_address):
+    return FakePort(
+        id=port_id,
+        name=f"opp-node-{port_id}",
+        mac_address=mac_address,
+        fixed_ips=[{'subnet_id': SUBNET.id, 'ip_address': ip_address}],
+    )
+
+
+def _write_config(config_destination, if_number, macaddress):
+    config = {'network': {'ethernets': {f"ens{if_number}": {'match': {'macaddress': macaddress}}}}}
+    (config_destination / f"51-opp-ens{if_number}.yaml").write_text(yaml.safe_dump(config))
+
+
+def _config_macaddresses(config_destination):
+    config_macaddresses = {}
+    for config_path in config_destination.glob("51-opp-ens*.yaml"):
+        config = yaml.safe_load(config_path.read_text())
+        for if_name, if_config in config['network']['ethernets'].items():
+            config_macaddresses[if_name] = if_config['match']['macaddress']
+    return config_macaddresses
+
+
+@pytest.fixture
+def config_templates(tmp_path):
+    config_templates = tmp_path / "templates"
+    config_templates.mkdir()
+    (config_templates / f"{SUBNET.name}.yaml").write_text(CONFIG_TEMPLATE)
+    return config_templates
+
+
+@pytest.fixture
+def config_destination(tmp_path):
+    config_destination = tmp_path / "netplan"
+    config_destination.mkdir()
+    return config_destination
+
+
+@pytest.fixture
+def net_if_stats(monkeypatch):
+    net_if_stats = {"lo": None}
+    monkeypatch.setattr(psutil, "net_if_stats", lambda: net_if_stats)
+    return net_if_stats
+
+
+@pytest.fixture
+def handler(config_templates):
+    return NetplanNetworkingConfigHandler(config_templates, apply_cmd=["true"])
+
+
+def test_create_reuses_interface_number_of_existing_config(handler, config_destination, net_if_stats):
+    _write_config(config_destination, 6, "FA:16:3E:00:00:01")
+
+    handler.create(_port("a", "fa:16:3e:00:00:01", "10.0.0.1"), SUBNET, config_destination)
+
+    assert _config_macaddresses(config_destination) == {"ens6": "fa:16:3e:00:00:01"}
+
+
+def test_create_uses_lowest_free_interface_number(handler, config_destination, net_if_stats):
+    _write_config(config_destination, 4, "fa:16:3e:00:00:01")
+    net_if_stats["ens5"] = None
+
+    handler.create(_port("b", "fa:16:3e:00:00:02", "10.0.0.2"), SUBNET, config_destination)
+
+    assert _config_macaddresses(config_destination) == {"ens4": "fa:16:3e:00:00:01", "ens6": "fa:16:3e:00:00:02"}
+
+
+def test_create_assigns_distinct_interface_numbers_in_one_pass(handler, config_destination, net_if_stats):
+    handler.create(_port("a", "fa:16:3e:00:00:01", "10.0.0.1"), SUBNET, config_destination)
+    handler.create(_port("b", "fa:16:3e:00:00:02", "10.0.0.2"), SUBNET, config_destination)
+
+    assert _config_macaddresses(config_destination) == {"ens4": "fa:16:3e:00:00:01", "ens5": "fa:16:3e:00:00:02"}
+
+
+def test_create_keeps_interface_numbers_after_restart(config_templates, config_destination, net_if_stats):
+    port_a = _port("a", "fa:16:3e:00:00:01", "10.0.0.1")
+    port_b = _port("b", "fa:16:3e:00:00:02", "10.0.0.2")
+
+    handler = NetplanNetworkingConfigHandler(config_templates, apply_cmd=["true"])
+    handler.create(port_a, SUBNET, config_destination)
+    handler.create(port_b, SUBNET, config_destination)
+
+    restarted_handler = NetplanNetworkingConfigHandler(config_templates, apply_cmd=["true"])
+    restarted_handler.create(port_b, SUBNET, config_destination)
+    restarted_handler.create(port_a, SUBNET, config_destination)
+
+    assert _config_macaddresses(config_destination) == {"ens4": "fa:16:3e:00:00:01", "ens5": "fa:16:3e:00:00:02"}
+
+
+def test_create_reserves_number_of_config_with_non_string_macaddress(handler, config_destination, net_if_stats):
+    # an unquoted mac address of digits only is parsed as a sexagesimal int
+    (config_destination / "51-opp-ens4.yaml").write_text(
+        "network:\n  ethernets:\n    ens4:\n      match:\n        macaddress: 12:34:56:12:34:56\n"
+    )
+
+    handler.create(_port("a", "fa:16:3e:00:00:01", "10.0.0.1"), SUBNET, config_destination)
+
+    assert (config_destination / "51-opp-ens5.yaml").exists()